@@ -1,8 +1,35 @@
+from django import forms
 from django.contrib import admin
-from django.contrib.contenttypes.admin import GenericTabularInline
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.contenttypes.models import ContentType
-from django import forms
-from .models import Book, MusicAlbum, SoftwareLicense, ShoppingCart, ShoppingCartItem
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+from .models import (
+    Book,
+    MusicAlbum,
+    SoftwareLicense,
+    ShoppingCart,
+    ShoppingCartItem,
+    PRODUCT_MODELS,
+    cents_to_euros,
+    grams_to_kilograms,
+)
+
+def allowed_content_type_ids():
+    """
+    Return the ids of the ContentTypes that can be added to a cart.
+    
+    get_for_models() is served from ContentType's in-process cache after
+    the first call, so this no longer costs a lookup query per use.
+    """
+    content_types = ContentType.objects.get_for_models(*PRODUCT_MODELS.values())
+    return [ct.pk for ct in content_types.values()]
+
+
+def allowed_content_types():
+    """Return the ContentTypes that can be added to a cart."""
+    return ContentType.objects.filter(pk__in=allowed_content_type_ids())
+
 
 # Register your models here.
 @admin.register(Book)
@@ -22,241 +49,50 @@ class SoftwareLicenseAdmin(admin.ModelAdmin):
     list_display = ['id', 'price_in_euros', 'weight_in_kilograms']
 
 
-class ShoppingCartItemInline(GenericTabularInline):
-    """Inline admin for managing cart items directly from the cart."""
-    model = ShoppingCartItem
-    ct_field = 'content_type'
-    ct_fk_field = 'object_id'
-    extra = 1
-    # GenericTabularInline automatically includes content_type and object_id, so we don't need to list them
-    fields = ['content_type', 'object_id', 'quantity', 'get_product_info', 'product_price', 'product_weight', 'get_subtotal_price', 'get_subtotal_weight']
-    readonly_fields = ['get_product_info', 'product_price', 'product_weight', 'get_subtotal_price', 'get_subtotal_weight']
-    can_delete = False  # Disable deletion from inline
-    verbose_name = "Cart Item"
-    verbose_name_plural = "Cart Items"
-    
-    def has_add_permission(self, request, obj=None):
-        """Allow adding new items."""
-        return True
-    
-    def has_change_permission(self, request, obj=None):
-        """Allow viewing existing items (read-only)."""
-        return True
-    
-    def has_delete_permission(self, request, obj=None):
-        """Disable deletion of existing items from inline."""
-        return False
-    
-    def get_formset(self, request, obj=None, **kwargs):
-        """Override to ensure formset handles content_type properly."""
-        from django.contrib.contenttypes.forms import BaseGenericInlineFormSet
-        
-        formset_class = super().get_formset(request, obj, **kwargs)
-        original_form_init = formset_class.form.__init__
-        original_form_clean = formset_class.form.clean
-        
-        def form_init(self, *args, **kwargs):
-            original_form_init(self, *args, **kwargs)
-            # Check if this is an existing item (has instance with pk)
-            is_existing_item = hasattr(self, 'instance') and self.instance and self.instance.pk
-            
-            # Ensure content_type and object_id fields exist and are configured
-            if hasattr(self, 'fields'):
-                # Make sure content_type exists - create it if needed
-                if 'content_type' not in self.fields:
-                    from django.contrib.contenttypes.models import ContentType as CT
-                    from django.forms import ModelChoiceField
-                    self.fields['content_type'] = ModelChoiceField(
-                        queryset=CT.objects.none(),
-                        required=False
-                    )
-                if 'content_type' in self.fields:
-                    if is_existing_item:
-                        # Make read-only for existing items
-                        self.fields['content_type'].widget.attrs['readonly'] = True
-                        self.fields['content_type'].widget.attrs['disabled'] = True
-                    else:
-                        # Allow selection for new items
-                        allowed_content_types = ContentType.objects.filter(
-                            model__in=['book', 'musicalbum', 'softwarelicense']
-                        )
-                        self.fields['content_type'].queryset = allowed_content_types
-                        self.fields['content_type'].empty_label = "Select product type..."
-                
-                # Make sure object_id exists - create it if needed
-                if 'object_id' not in self.fields:
-                    from django.forms import UUIDField
-                    self.fields['object_id'] = UUIDField(required=False)
-                
-                if 'object_id' in self.fields:
-                    if is_existing_item:
-                        # Make read-only for existing items
-                        self.fields['object_id'].widget.attrs['readonly'] = True
-                        self.fields['object_id'].widget.attrs['disabled'] = True
-                    else:
-                        self.fields['object_id'].help_text = "Enter the UUID of the product"
-                
-                if 'quantity' in self.fields:
-                    if is_existing_item:
-                        # Make read-only for existing items
-                        self.fields['quantity'].widget.attrs['readonly'] = True
-                        self.fields['quantity'].widget.attrs['disabled'] = True
-                    else:
-                        self.fields['quantity'].help_text = "Number of items to add"
-        
-        def form_clean(self):
-            """Auto-set price and weight from product."""
-            # For disabled fields (read-only existing items), we need to handle them specially
-            is_existing_item = hasattr(self, 'instance') and self.instance and self.instance.pk
-            
-            cleaned_data = original_form_clean(self)
-            
-            # For disabled fields, restore values from instance if not in cleaned_data
-            if hasattr(self, 'instance') and self.instance and self.instance.pk:
-                if 'content_type' in self.fields and self.fields['content_type'].widget.attrs.get('disabled'):
-                    if not cleaned_data.get('content_type'):
-                        cleaned_data['content_type'] = self.instance.content_type
-                if 'object_id' in self.fields and self.fields['object_id'].widget.attrs.get('disabled'):
-                    if not cleaned_data.get('object_id'):
-                        cleaned_data['object_id'] = self.instance.object_id
-                if 'quantity' in self.fields and self.fields['quantity'].widget.attrs.get('disabled'):
-                    if not cleaned_data.get('quantity'):
-                        cleaned_data['quantity'] = self.instance.quantity
-            
-            content_type = cleaned_data.get('content_type')
-            object_id = cleaned_data.get('object_id')
-            
-            # Only auto-set price/weight for new items
-            if content_type and object_id:
-                is_new_item = not (hasattr(self, 'instance') and self.instance and self.instance.pk)
-                if is_new_item:
-                    # New item - set price and weight from product
-                    model_class = content_type.model_class()
-                    if model_class:
-                        try:
-                            product = model_class.objects.get(id=object_id)
-                            cleaned_data['product_price'] = product.price_in_euros
-                            cleaned_data['product_weight'] = product.weight_in_kilograms
-                        except model_class.DoesNotExist:
-                            raise forms.ValidationError(
-                                f"{content_type.model} with id {object_id} does not exist."
-                            )
-            
-            return cleaned_data
-        
-        # Create a custom formset class that ensures empty_form is configured
-        class CustomFormSet(formset_class):
-            def __init__(self, *args, **kwargs):
-                super().__init__(*args, **kwargs)
-                # Configure empty_form after it's created
-                if hasattr(self, 'empty_form') and hasattr(self.empty_form, 'fields'):
-                    # Ensure content_type exists
-                    if 'content_type' not in self.empty_form.fields:
-                        from django.contrib.contenttypes.models import ContentType as CT
-                        from django.forms import ModelChoiceField
-                        self.empty_form.fields['content_type'] = ModelChoiceField(
-                            queryset=CT.objects.none(),
-                            required=False
-                        )
-                    
-                    if 'content_type' in self.empty_form.fields:
-                        allowed_content_types = ContentType.objects.filter(
-                            model__in=['book', 'musicalbum', 'softwarelicense']
-                        )
-                        self.empty_form.fields['content_type'].queryset = allowed_content_types
-                        self.empty_form.fields['content_type'].empty_label = "Select product type..."
-                    
-                    # Ensure object_id exists
-                    if 'object_id' not in self.empty_form.fields:
-                        from django.forms import UUIDField
-                        self.empty_form.fields['object_id'] = UUIDField(required=False)
-                    
-                    if 'object_id' in self.empty_form.fields:
-                        self.empty_form.fields['object_id'].help_text = "Enter the UUID of the product"
-                    if 'quantity' in self.empty_form.fields:
-                        self.empty_form.fields['quantity'].help_text = "Number of items to add"
-        
-        # Apply custom methods to the form class
-        CustomFormSet.form.__init__ = form_init
-        CustomFormSet.form.clean = form_clean
-        
-        return CustomFormSet
-    
-    def formfield_for_dbfield(self, db_field, request, **kwargs):
-        """Filter content types to only show Book, MusicAlbum, and SoftwareLicense."""
-        if db_field.name == 'content_type':
-            kwargs['queryset'] = ContentType.objects.filter(
-                model__in=['book', 'musicalbum', 'softwarelicense']
-            )
-            kwargs['empty_label'] = "Select product type..."
-        return super().formfield_for_dbfield(db_field, request, **kwargs)
-    
-    def get_product_info(self, obj):
-        """Display product information if item is saved."""
-        if obj.pk and obj.product:
-            if isinstance(obj.product, Book):
-                return f"Book: {obj.product.title}"
-            elif isinstance(obj.product, MusicAlbum):
-                return f"Album: {obj.product.artist}"
-            elif isinstance(obj.product, SoftwareLicense):
-                return f"License: {obj.product.id}"
-        return "Select product type and enter product ID"
-    get_product_info.short_description = 'Product'
-    
-    def get_subtotal_price(self, obj):
-        if obj and obj.pk:
-            try:
-                subtotal = obj.get_subtotal_price()
-                return f"€{float(subtotal):.2f}"
-            except (TypeError, ValueError, AttributeError):
-                return "-"
-        return "-"
-    get_subtotal_price.short_description = 'Subtotal Price'
-    
-    def get_subtotal_weight(self, obj):
-        if obj and obj.pk:
-            try:
-                subtotal = obj.get_subtotal_weight()
-                return f"{float(subtotal):.2f} kg"
-            except (TypeError, ValueError, AttributeError):
-                return "-"
-        return "-"
-    get_subtotal_weight.short_description = 'Subtotal Weight'
-
-
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'created_at', 'get_item_count', 'get_total_price', 'get_total_weight']
     list_filter = ['created_at', 'user']
-    readonly_fields = ['id', 'created_at', 'updated_at', 'get_total_price_display', 'get_total_weight_display', 'get_item_count_display']
-    inlines = [ShoppingCartItemInline]
+    list_select_related = ('user',)
+    list_per_page = 50
+    readonly_fields = ['id', 'created_at', 'updated_at', 'get_total_price_display', 'get_total_weight_display', 'get_item_count_display', 'items_table_html']
     fieldsets = (
         ('Cart Information', {
             'fields': ('id', 'user', 'created_at', 'updated_at')
         }),
+        ('Cart Items', {
+            'fields': ('items_table_html',)
+        }),
         ('Cart Summary', {
             'fields': ('get_total_price_display', 'get_total_weight_display', 'get_item_count_display'),
             'classes': ('collapse',)
         }),
     )
     
+    def get_queryset(self, request):
+        # Annotate totals and item count so list rows don't aggregate per cart
+        return super().get_queryset(request).with_totals()
+    
     def get_total_price(self, obj):
         if obj.pk:
             return f"€{obj.calculate_total_price():.2f}"
         return "-"
     get_total_price.short_description = 'Total Price'
+    get_total_price.admin_order_field = 'total_price_cents_ann'
     
     def get_total_weight(self, obj):
         if obj.pk:
             return f"{obj.calculate_total_weight():.2f} kg"
         return "-"
     get_total_weight.short_description = 'Total Weight'
+    get_total_weight.admin_order_field = 'total_weight_grams_ann'
     
     def get_item_count(self, obj):
         if obj.pk:
-            return obj.items.count()
+            return obj.calculate_item_count()
         return 0
     get_item_count.short_description = 'Items'
+    get_item_count.admin_order_field = 'item_count_ann'
     
     # Display fields for detail view
     def get_total_price_display(self, obj):
@@ -273,15 +109,103 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     
     def get_item_count_display(self, obj):
         if obj.pk:
-            return obj.items.count()
+            return obj.calculate_item_count()
         return 0
     get_item_count_display.short_description = 'Item Count'
+    
+    def items_table_html(self, obj):
+        """
+        Render the cart's items as a read-only table.
+        
+        Items are loaded in one query with their subtotals and stored product
+        names. Editing happens in the cart item admin.
+        """
+        # The id defaults to a new uuid, so check _state rather than pk for unsaved carts
+        if obj._state.adding:
+            return "Save the cart before adding items."
+        
+        items = list(
+            obj.items.with_subtotals().select_related('content_type')
+        )
+        add_url = f"{reverse('admin:store_shoppingcartitem_add')}?cart={obj.pk}"
+        add_link = format_html('<a href="{}" class="addlink">Add cart item</a>', add_url)
+        if not items:
+            return format_html('<p>No items in this cart.</p>{}', add_link)
+        
+        rows = format_html_join(
+            '\n',
+            '<tr><td><a href="{}">{}</a></td><td>{}</td><td>{}</td>'
+            '<td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>',
+            (
+                (
+                    reverse('admin:store_shoppingcartitem_change', args=[item.pk]),
+                    item.product_display_name or "-",
+                    item.content_type.model,
+                    item.quantity,
+                    f"€{item.product_price:.2f}",
+                    f"{item.product_weight:.2f} kg",
+                    f"€{cents_to_euros(item.subtotal_price_cents):.2f}",
+                    f"{grams_to_kilograms(item.subtotal_weight_grams):.2f} kg",
+                )
+                for item in items
+            )
+        )
+        return format_html(
+            '<table><thead><tr><th>Product</th><th>Type</th><th>Quantity</th>'
+            '<th>Price</th><th>Weight</th><th>Subtotal Price</th><th>Subtotal Weight</th>'
+            '</tr></thead><tbody>{}</tbody></table>{}',
+            rows,
+            add_link
+        )
+    items_table_html.short_description = 'Items'
+
+
+class ShoppingCartItemChangeList(ChangeList):
+    """Changelist that only loads the columns rendered in list_display."""
+    
+    def get_queryset(self, request, *args, **kwargs):
+        return super().get_queryset(request, *args, **kwargs).only(
+            'id', 'cart__id', 'content_type__app_label', 'content_type__model',
+            'object_id', 'quantity', 'price_in_cents', 'weight_in_grams', 'product_display_name'
+        )
+
+
+class ShoppingCartItemAdminForm(forms.ModelForm):
+    """Cart item form that checks the chosen product exists."""
+    
+    class Meta:
+        model = ShoppingCartItem
+        fields = ['cart', 'content_type', 'object_id', 'quantity']
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        content_type = cleaned_data.get('content_type')
+        object_id = cleaned_data.get('object_id')
+        
+        if content_type and object_id:
+            model_class = PRODUCT_MODELS.get(content_type.model)
+            if model_class is None:
+                raise forms.ValidationError({'content_type': "Select a book, music album or software license."})
+            
+            product = model_class.objects.in_bulk([object_id]).get(object_id)
+            if product is None:
+                raise forms.ValidationError(
+                    {'object_id': f"{content_type.model} with id {object_id} does not exist."}
+                )
+            # Cache the product so save() fills price, weight and name without refetching it
+            self.instance.product = product
+        
+        return cleaned_data
 
 
 @admin.register(ShoppingCartItem)
 class ShoppingCartItemAdmin(admin.ModelAdmin):
+    form = ShoppingCartItemAdminForm
+    # Carts are picked by id; a select would list every cart in the database
+    raw_id_fields = ['cart']
     list_display = ['id', 'cart', 'get_product_type', 'get_product_name', 'quantity', 'get_subtotal_price', 'get_subtotal_weight']
     list_filter = ['cart', 'created_at', 'content_type']
+    list_select_related = ('cart', 'content_type')
     readonly_fields = ['id', 'created_at', 'updated_at', 'product_price', 'product_weight', 'get_subtotal_price', 'get_subtotal_weight']
     search_fields = ['cart__id', 'object_id']
     
@@ -301,17 +225,36 @@ class ShoppingCartItemAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         # Filter to only show items with allowed content types
-        allowed_content_types = ContentType.objects.filter(
-            model__in=['book', 'musicalbum', 'softwarelicense']
+        return qs.filter(content_type_id__in=allowed_content_type_ids()).with_subtotals().select_related(
+            'content_type', 'cart'
         )
-        return qs.filter(content_type__in=allowed_content_types)
+    
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = list(super().get_readonly_fields(request, obj))
+        if obj is not None:
+            # Price, weight and name are locked in from the product when the
+            # item is added, so an existing item can't be pointed at another product
+            readonly_fields += ['content_type', 'object_id']
+        return readonly_fields
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        # Deletes send no signal that touches the cart (see signals.py)
+        ShoppingCart(pk=obj.cart_id).touch()
+    
+    def delete_queryset(self, request, queryset):
+        cart_ids = list(queryset.values_list('cart_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        ShoppingCart.objects.filter(pk__in=cart_ids).touch()
+    
+    def get_changelist(self, request, **kwargs):
+        # The change form still loads full rows through get_queryset
+        return ShoppingCartItemChangeList
     
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == 'content_type':
             # Filter content types to only show Book, MusicAlbum, and SoftwareLicense
-            kwargs['queryset'] = ContentType.objects.filter(
-                model__in=['book', 'musicalbum', 'softwarelicense']
-            )
+            kwargs['queryset'] = allowed_content_types()
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
     
     def get_product_type(self, obj):
@@ -320,32 +263,35 @@ class ShoppingCartItemAdmin(admin.ModelAdmin):
     get_product_type.admin_order_field = 'content_type__model'
     
     def get_product_name(self, obj):
-        if obj.product:
-            if isinstance(obj.product, Book):
-                return obj.product.title
-            elif isinstance(obj.product, MusicAlbum):
-                return f"Album by {obj.product.artist}"
-            elif isinstance(obj.product, SoftwareLicense):
-                return str(obj.product.id)
-        return "-"
+        return obj.product_display_name or "-"
     get_product_name.short_description = 'Product'
     
     def get_subtotal_price(self, obj):
         if obj and obj.pk:
             try:
-                subtotal = obj.get_subtotal_price()
-                return f"€{float(subtotal):.2f}"
+                subtotal_cents = getattr(obj, 'subtotal_price_cents', None)
+                if subtotal_cents is None:
+                    subtotal = obj.get_subtotal_price()
+                else:
+                    subtotal = cents_to_euros(subtotal_cents)
+                return f"€{subtotal:.2f}"
             except (TypeError, ValueError, AttributeError):
                 return "-"
         return "-"
     get_subtotal_price.short_description = 'Subtotal Price'
+    get_subtotal_price.admin_order_field = 'subtotal_price_cents'
     
     def get_subtotal_weight(self, obj):
         if obj and obj.pk:
             try:
-                subtotal = obj.get_subtotal_weight()
-                return f"{float(subtotal):.2f} kg"
+                subtotal_grams = getattr(obj, 'subtotal_weight_grams', None)
+                if subtotal_grams is None:
+                    subtotal = obj.get_subtotal_weight()
+                else:
+                    subtotal = grams_to_kilograms(subtotal_grams)
+                return f"{subtotal:.2f} kg"
             except (TypeError, ValueError, AttributeError):
                 return "-"
         return "-"
     get_subtotal_weight.short_description = 'Subtotal Weight'
+    get_subtotal_weight.admin_order_field = 'subtotal_weight_grams'
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-15 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['user', '-created_at'], name='store_shopp_user_id_26b940_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcartitem',
+            index=models.Index(fields=['cart', 'created_at'], name='store_shopp_cart_id_3dd9de_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2 on 2026-10-15 10:47
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+
+def copy_to_minor_units(apps, schema_editor):
+    ShoppingCartItem = apps.get_model('store', 'ShoppingCartItem')
+    ShoppingCartItem.objects.update(
+        # Round first: a plain cast truncates on some backends (19.99 * 100 -> 1998 on SQLite)
+        price_in_cents=Cast(Round(F('product_price') * 100), models.BigIntegerField()),
+        weight_in_grams=Cast(Round(F('product_weight') * 1000), models.BigIntegerField()),
+    )
+
+
+def copy_from_minor_units(apps, schema_editor):
+    # Converted in Python: a SQL cast-and-divide is integer division on SQLite
+    ShoppingCartItem = apps.get_model('store', 'ShoppingCartItem')
+    items = list(ShoppingCartItem.objects.only('price_in_cents', 'weight_in_grams'))
+    for item in items:
+        item.product_price = Decimal(item.price_in_cents).scaleb(-2)
+        item.product_weight = Decimal(item.weight_in_grams).scaleb(-3).quantize(
+            Decimal('0.01'), rounding=ROUND_HALF_UP
+        )
+    ShoppingCartItem.objects.bulk_update(items, ['product_price', 'product_weight'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_shoppingcart_store_shopp_user_id_26b940_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppingcartitem',
+            name='price_in_cents',
+            field=models.PositiveBigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcartitem',
+            name='weight_in_grams',
+            field=models.PositiveBigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        # Nullable before removal, so reversing can re-add the columns to a
+        # table that already has rows and refill them from the new fields
+        migrations.AlterField(
+            model_name='shoppingcartitem',
+            name='product_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='shoppingcartitem',
+            name='product_weight',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(copy_to_minor_units, copy_from_minor_units),
+        migrations.RemoveField(
+            model_name='shoppingcartitem',
+            name='product_price',
+        ),
+        migrations.RemoveField(
+            model_name='shoppingcartitem',
+            name='product_weight',
+        ),
+    ]
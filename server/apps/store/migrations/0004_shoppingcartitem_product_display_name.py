@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-15 11:58
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+# Mirrors store.models.get_product_display_name; historical models have no
+# custom __str__, so the artist is rendered by username like AbstractUser does
+PRODUCT_LABELS = {
+    'book': lambda product: product.title,
+    'musicalbum': lambda product: f"Album by {product.artist.username}",
+    'softwarelicense': lambda product: f"License {product.id}",
+}
+
+
+def fill_product_display_name(apps, schema_editor):
+    ShoppingCartItem = apps.get_model('store', 'ShoppingCartItem')
+
+    items_by_model = defaultdict(list)
+    for item in ShoppingCartItem.objects.select_related('content_type'):
+        if item.content_type.model in PRODUCT_LABELS:
+            items_by_model[item.content_type.model].append(item)
+
+    for model_name, items in items_by_model.items():
+        model = apps.get_model('store', model_name)
+        queryset = model.objects.select_related('artist') if model_name == 'musicalbum' else model.objects.all()
+        products = queryset.in_bulk([item.object_id for item in items])
+        for item in items:
+            product = products.get(item.object_id)
+            if product is not None:
+                item.product_display_name = PRODUCT_LABELS[model_name](product)
+        ShoppingCartItem.objects.bulk_update(items, ['product_display_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_shoppingcartitem_price_in_cents_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppingcartitem',
+            name='product_display_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(fill_product_display_name, migrations.RunPython.noop),
+    ]
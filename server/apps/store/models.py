@@ -1,10 +1,56 @@
 import uuid
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import IntegrityError, models, transaction
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from django.db.models import Sum
+from django.core.cache import cache
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
 from apps.users.models import User
 
+# Seconds cart totals stay cached; the key also changes whenever the cart is touched
+CART_TOTALS_CACHE_TIMEOUT = 300
+
+
+def euros_to_cents(amount):
+    """Convert a euro amount to integer cents."""
+    return int((Decimal(amount) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def kilograms_to_grams(weight):
+    """Convert a weight in kilograms to integer grams."""
+    return int((Decimal(weight) * 1000).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def cents_to_euros(cents):
+    """Convert integer cents to a two-decimal euro amount."""
+    return Decimal(cents).scaleb(-2)
+
+
+def grams_to_kilograms(grams):
+    """Convert integer grams to kilograms, with the two decimals product weights use."""
+    return Decimal(grams).scaleb(-3).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _line_total(quantity, amount):
+    """Return quantity * amount as a bigint expression, so large lines can't overflow int4."""
+    return Cast(quantity, models.BigIntegerField()) * F(amount)
+
+
+# Display label per product model, computed once when a product is added to a cart
+_PRODUCT_LABEL = {
+    'book': lambda product: product.title,
+    'musicalbum': lambda product: f"Album by {product.artist}",
+    'softwarelicense': lambda product: f"License {product.id}",
+}
+
+
+def get_product_display_name(product):
+    """Return the human-readable name shown for a product in carts and recommendations."""
+    label = _PRODUCT_LABEL.get(product._meta.model_name)
+    return label(product) if label else str(product)
+
 
 # Create your models here.
 class Book(models.Model):
@@ -37,6 +83,45 @@ class SoftwareLicense(models.Model):
         return str(self.id)
 
 
+# Product type names used by the API (the ContentType model names) mapped to
+# their models, so resolving a product type needs no ContentType query
+PRODUCT_MODELS = {
+    'book': Book,
+    'musicalbum': MusicAlbum,
+    'softwarelicense': SoftwareLicense,
+}
+
+
+class ShoppingCartQuerySet(models.QuerySet):
+    def touch(self):
+        """Bump updated_at on these carts, which also invalidates their cached totals."""
+        return self.update(updated_at=timezone.now())
+    
+    def with_totals(self):
+        """
+        Annotate each cart with its totals in the same SQL query.
+        
+        Adds total_price_cents_ann, total_weight_grams_ann and
+        item_count_ann, which the calculate_* methods pick up instead of
+        running their own aggregate.
+        
+        Django drops Meta.ordering from aggregated (GROUP BY) queries, so the
+        model's ordering is applied explicitly unless one was already set.
+        """
+        queryset = self if self.query.order_by else self.order_by(*self.model._meta.ordering)
+        return queryset.annotate(
+            total_price_cents_ann=Coalesce(
+                Sum(_line_total('items__quantity', 'items__price_in_cents')),
+                Value(0),
+            ),
+            total_weight_grams_ann=Coalesce(
+                Sum(_line_total('items__quantity', 'items__weight_in_grams')),
+                Value(0),
+            ),
+            item_count_ann=Count('items', distinct=True),
+        )
+
+
 class ShoppingCart(models.Model):
     """Represents a shopping cart that can contain multiple products."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -44,8 +129,14 @@ class ShoppingCart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ShoppingCartQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Covers the per-user cart listing, which is ordered by -created_at
+            models.Index(fields=['user', '-created_at']),
+        ]
     
     def __str__(self):
         return f"Shopping Cart {self.id}"
@@ -59,29 +150,107 @@ class ShoppingCart(models.Model):
             quantity: Number of items to add (default: 1)
         
         Returns:
-            ShoppingCartItem: The created or updated cart item
+            None. The item isn't read back after the increment, to save a
+            query; reload the cart's items to see its new quantity.
         """
         # Get the ContentType for the product
         content_type = ContentType.objects.get_for_model(product.__class__)
         
-        # Try to get existing cart item for this product
-        cart_item, created = ShoppingCartItem.objects.get_or_create(
-            cart=self,
-            content_type=content_type,
-            object_id=product.id,
-            defaults={
-                'quantity': quantity,
-                'product_price': product.price_in_euros,
-                'product_weight': product.weight_in_kilograms
-            }
+        cart_items = ShoppingCartItem.objects.filter(
+            cart_id=self.pk,
+            content_type_id=content_type.pk,
+            object_id=product.id
         )
         
-        # If item already exists, update quantity
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        def increment_quantity():
+            return cart_items.update(
+                quantity=F('quantity') + quantity,
+                updated_at=timezone.now()
+            )
+        
+        with transaction.atomic():
+            self._lock()
+            if increment_quantity():
+                # QuerySet.update() sends no signals, so invalidate cached totals here
+                self.touch()
+                return
+            
+            try:
+                # Savepoint so losing an insert race to a writer that doesn't
+                # take the cart lock (e.g. the admin) doesn't abort the outer
+                # transaction. create() sends post_save, which touches the cart.
+                with transaction.atomic():
+                    ShoppingCartItem.objects.create(
+                        cart=self,
+                        content_type_id=content_type.pk,
+                        object_id=product.id,
+                        quantity=quantity,
+                        price_in_cents=euros_to_cents(product.price_in_euros),
+                        weight_in_grams=kilograms_to_grams(product.weight_in_kilograms),
+                        product_display_name=get_product_display_name(product)
+                    )
+            except IntegrityError:
+                # The other writer inserted the item first; add to it instead
+                increment_quantity()
+                self.touch()
+    
+    def add_products(self, products):
+        """
+        Add several products to the shopping cart in one batched upsert.
+        
+        Quantities of products already in the cart are incremented, and
+        repeated products are merged. Existing items keep their cached
+        price and weight, as with add_product.
+        
+        Args:
+            products: Iterable of (product, quantity) pairs
+        
+        Returns:
+            int: Number of distinct products added or updated
+        """
+        entries = {}
+        for product, quantity in products:
+            content_type = ContentType.objects.get_for_model(product.__class__)
+            key = (content_type.pk, product.id)
+            if key in entries:
+                entries[key][1] += quantity
+            else:
+                entries[key] = [product, quantity]
         
-        return cart_item
+        if not entries:
+            return 0
+        
+        with transaction.atomic():
+            self._lock()
+            existing_quantities = {
+                (item['content_type_id'], item['object_id']): item['quantity']
+                for item in self.items.filter(
+                    object_id__in=[object_id for _, object_id in entries]
+                ).values('content_type_id', 'object_id', 'quantity')
+            }
+            
+            cart_items = [
+                ShoppingCartItem(
+                    cart=self,
+                    content_type_id=content_type_id,
+                    object_id=object_id,
+                    quantity=existing_quantities.get((content_type_id, object_id), 0) + quantity,
+                    price_in_cents=euros_to_cents(product.price_in_euros),
+                    weight_in_grams=kilograms_to_grams(product.weight_in_kilograms),
+                    product_display_name=get_product_display_name(product)
+                )
+                for (content_type_id, object_id), (product, quantity) in entries.items()
+            ]
+            ShoppingCartItem.objects.bulk_create(
+                cart_items,
+                update_conflicts=True,
+                unique_fields=['cart', 'content_type', 'object_id'],
+                update_fields=['quantity', 'updated_at']
+            )
+            # bulk_create() sends no signals, so invalidate cached totals here
+            self.touch()
+        
+        return len(cart_items)
     
     def remove_product(self, product, quantity=1):
         """
@@ -97,8 +266,8 @@ class ShoppingCart(models.Model):
         content_type = ContentType.objects.get_for_model(product.__class__)
         
         try:
-            cart_item = ShoppingCartItem.objects.get(
-                cart=self,
+            # Fetched through self.items so the item's cart is this instance
+            cart_item = self.items.get(
                 content_type=content_type,
                 object_id=product.id
             )
@@ -106,6 +275,8 @@ class ShoppingCart(models.Model):
             # If removing all or more, delete the item
             if cart_item.quantity <= quantity:
                 cart_item.delete()
+                # Deletes send no signal that touches the cart (see signals.py)
+                self.touch()
                 return True
             else:
                 # Reduce quantity
@@ -119,25 +290,82 @@ class ShoppingCart(models.Model):
         """
         Calculate the total price of all items in the shopping cart.
         
+        Uses the total_price_cents_ann annotation when the cart was loaded
+        through ShoppingCart.objects.with_totals().
+        
         Returns:
             decimal.Decimal: Total price in euros
         """
-        total = self.items.aggregate(
-            total=Sum(models.F('quantity') * models.F('product_price'))
-        )['total']
-        return total or 0
+        total_cents = getattr(self, 'total_price_cents_ann', None)
+        if total_cents is None:
+            total_cents = self._get_totals()[0]
+        return cents_to_euros(total_cents)
     
     def calculate_total_weight(self):
         """
         Calculate the total weight of all items in the shopping cart.
         
+        Uses the total_weight_grams_ann annotation when the cart was loaded
+        through ShoppingCart.objects.with_totals().
+        
         Returns:
             decimal.Decimal: Total weight in kilograms
         """
-        total = self.items.aggregate(
-            total=Sum(models.F('quantity') * models.F('product_weight'))
-        )['total']
-        return total or 0
+        total_grams = getattr(self, 'total_weight_grams_ann', None)
+        if total_grams is None:
+            total_grams = self._get_totals()[1]
+        return grams_to_kilograms(total_grams)
+    
+    def calculate_item_count(self):
+        """
+        Count the distinct items in the shopping cart.
+        
+        Uses the item_count_ann annotation when the cart was loaded
+        through ShoppingCart.objects.with_totals().
+        
+        Returns:
+            int: Number of cart items
+        """
+        item_count = getattr(self, 'item_count_ann', None)
+        if item_count is None:
+            item_count = self._get_totals()[2]
+        return item_count
+    
+    def _lock(self):
+        """
+        Lock this cart's row until the surrounding transaction ends.
+        
+        add_product and add_products take this lock before reading or
+        inserting items, so concurrent adds to the same cart run one after
+        another and neither can lose the other's increment or new row.
+        """
+        ShoppingCart.objects.select_for_update().only('id').get(pk=self.pk)
+    
+    def touch(self):
+        """Bump updated_at, which also invalidates the cached totals."""
+        self.updated_at = timezone.now()
+        ShoppingCart.objects.filter(pk=self.pk).update(updated_at=self.updated_at)
+    
+    def _compute_totals(self):
+        totals = self.items.aggregate(
+            total_price_cents=Sum(_line_total('quantity', 'price_in_cents')),
+            total_weight_grams=Sum(_line_total('quantity', 'weight_in_grams')),
+            item_count=Count('id'),
+        )
+        return totals['total_price_cents'] or 0, totals['total_weight_grams'] or 0, totals['item_count']
+    
+    def _get_totals(self):
+        """
+        Return (total_price_cents, total_weight_grams, item_count), cached per updated_at.
+        
+        Item saves and deletes touch the cart (see signals.py), so a changed
+        cart gets a new cache key instead of serving stale totals. An unsaved
+        cart has no items and nothing to cache.
+        """
+        if self._state.adding or self.updated_at is None:
+            return 0, 0, 0
+        cache_key = f'cart:{self.pk}:{self.updated_at.timestamp()}:totals'
+        return cache.get_or_set(cache_key, self._compute_totals, CART_TOTALS_CACHE_TIMEOUT)
     
     def get_total_price(self):
         """Alias for calculate_total_price for convenience."""
@@ -148,6 +376,15 @@ class ShoppingCart(models.Model):
         return self.calculate_total_weight()
 
 
+class ShoppingCartItemQuerySet(models.QuerySet):
+    def with_subtotals(self):
+        """Annotate each item with subtotal_price_cents and subtotal_weight_grams computed in SQL."""
+        return self.annotate(
+            subtotal_price_cents=_line_total('quantity', 'price_in_cents'),
+            subtotal_weight_grams=_line_total('quantity', 'weight_in_grams'),
+        )
+
+
 class ShoppingCartItem(models.Model):
     """Represents a single item in a shopping cart."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -159,41 +396,84 @@ class ShoppingCartItem(models.Model):
     object_id = models.UUIDField()
     product = GenericForeignKey('content_type', 'object_id')
     
-    # Cached fields for price and weight to optimize calculations
-    product_price = models.DecimalField(max_digits=10, decimal_places=2)
-    product_weight = models.DecimalField(max_digits=10, decimal_places=2)
+    # Cached fields for price and weight to optimize calculations, stored as
+    # integer cents/grams so totals and subtotals are integer arithmetic
+    price_in_cents = models.PositiveBigIntegerField()
+    weight_in_grams = models.PositiveBigIntegerField()
+    # Product label stored at add time so listings don't resolve the generic relation
+    product_display_name = models.CharField(max_length=255, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ShoppingCartItemQuerySet.as_manager()
+    
     class Meta:
         unique_together = ['cart', 'content_type', 'object_id']
         ordering = ['created_at']
+        indexes = [
+            # Covers loading a cart's items in the order they were added
+            models.Index(fields=['cart', 'created_at']),
+        ]
     
     def __str__(self):
         return f"{self.quantity}x {self.product} in cart {self.cart.id}"
     
     def save(self, *args, **kwargs):
-        """Override save to update cached price and weight from the product."""
-        if self.product:
-            self.product_price = self.product.price_in_euros
-            self.product_weight = self.product.weight_in_kilograms
+        """Override save to fill in cached price, weight and display name from the product when missing."""
+        # A blank name is only filled on create; an existing item may
+        # legitimately have one, and resolving the product costs a query
+        needs_product = (
+            self.price_in_cents is None
+            or self.weight_in_grams is None
+            or (self._state.adding and not self.product_display_name)
+        )
+        if needs_product and self.object_id:
+            product = self.product
+            if product:
+                if self.price_in_cents is None or self.weight_in_grams is None:
+                    self.product_price = product.price_in_euros
+                    self.product_weight = product.weight_in_kilograms
+                if not self.product_display_name:
+                    self.product_display_name = get_product_display_name(product)
         super().save(*args, **kwargs)
     
+    @property
+    def product_price(self):
+        """Cached product price in euros."""
+        if self.price_in_cents is None:
+            return None
+        return cents_to_euros(self.price_in_cents)
+    
+    @product_price.setter
+    def product_price(self, value):
+        self.price_in_cents = None if value is None else euros_to_cents(value)
+    
+    @property
+    def product_weight(self):
+        """Cached product weight in kilograms."""
+        if self.weight_in_grams is None:
+            return None
+        return grams_to_kilograms(self.weight_in_grams)
+    
+    @product_weight.setter
+    def product_weight(self, value):
+        self.weight_in_grams = None if value is None else kilograms_to_grams(value)
+    
     def get_subtotal_price(self):
         """
         Calculate the subtotal price for this cart item.
         
         Returns:
-            decimal.Decimal: Subtotal price (quantity * product_price)
+            decimal.Decimal: Subtotal price in euros (quantity * price_in_cents)
         """
-        return self.quantity * self.product_price
+        return cents_to_euros(self.quantity * self.price_in_cents)
     
     def get_subtotal_weight(self):
         """
         Calculate the subtotal weight for this cart item.
         
         Returns:
-            decimal.Decimal: Subtotal weight (quantity * product_weight)
+            decimal.Decimal: Subtotal weight in kilograms (quantity * weight_in_grams)
         """
-        return self.quantity * self.product_weight
+        return grams_to_kilograms(self.quantity * self.weight_in_grams)
@@ -1,6 +1,8 @@
+from collections import defaultdict
+from django.db import models
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
-from django.contrib.contenttypes.models import ContentType
-from .models import ShoppingCart, ShoppingCartItem, Book, MusicAlbum, SoftwareLicense
+from .models import ShoppingCart, ShoppingCartItem, Book, MusicAlbum, SoftwareLicense, PRODUCT_MODELS
 
 
 class ProductSerializer(serializers.Serializer):
@@ -36,6 +38,39 @@ class ProductSerializer(serializers.Serializer):
         return {}
 
 
+# Relations ProductSerializer renders, per product type
+PRODUCT_RELATED_FIELDS = {
+    'book': ['author'],
+    'musicalbum': ['artist'],
+}
+
+
+def prefetch_product_relations(cart_items):
+    """
+    Load the relations ProductSerializer renders for the items' products.
+    
+    Runs one query per product type instead of one User query per product;
+    products whose relations are already loaded are skipped.
+    """
+    products = defaultdict(list)
+    for item in cart_items:
+        if item.product is not None:
+            products[item.product._meta.model_name].append(item.product)
+    
+    for product_type, related_fields in PRODUCT_RELATED_FIELDS.items():
+        if products[product_type]:
+            prefetch_related_objects(products[product_type], *related_fields)
+
+
+class ShoppingCartItemListSerializer(serializers.ListSerializer):
+    """Serializes a cart's items after loading their products' relations in bulk."""
+    
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        prefetch_product_relations(items)
+        return super().to_representation(items)
+
+
 class ShoppingCartItemSerializer(serializers.ModelSerializer):
     """Serializer for shopping cart items."""
     product = ProductSerializer(read_only=True)
@@ -43,6 +78,10 @@ class ShoppingCartItemSerializer(serializers.ModelSerializer):
     subtotal_weight = serializers.SerializerMethodField()
     product_type = serializers.SerializerMethodField()
     product_id = serializers.UUIDField(source='object_id', read_only=True)
+    product_name = serializers.CharField(source='product_display_name', read_only=True)
+    # Stored as integer cents/grams; exposed in euros/kilograms
+    product_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    product_weight = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     
     class Meta:
         model = ShoppingCartItem
@@ -50,6 +89,7 @@ class ShoppingCartItemSerializer(serializers.ModelSerializer):
             'id',
             'product_id',
             'product_type',
+            'product_name',
             'product',
             'quantity',
             'product_price',
@@ -60,6 +100,7 @@ class ShoppingCartItemSerializer(serializers.ModelSerializer):
             'updated_at',
         ]
         read_only_fields = ['id', 'product_price', 'product_weight', 'created_at', 'updated_at']
+        list_serializer_class = ShoppingCartItemListSerializer
     
     def get_subtotal_price(self, obj):
         return str(obj.get_subtotal_price())
@@ -71,6 +112,18 @@ class ShoppingCartItemSerializer(serializers.ModelSerializer):
         return obj.content_type.model
 
 
+class ShoppingCartListSerializer(serializers.ListSerializer):
+    """
+    Serializes several carts, loading the product relations of all their
+    items together rather than cart by cart.
+    """
+    
+    def to_representation(self, data):
+        carts = list(data.all() if isinstance(data, models.Manager) else data)
+        prefetch_product_relations(item for cart in carts for item in cart.items.all())
+        return super().to_representation(carts)
+
+
 class ShoppingCartSerializer(serializers.ModelSerializer):
     """Serializer for shopping carts."""
     items = ShoppingCartItemSerializer(many=True, read_only=True)
@@ -91,6 +144,7 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             'updated_at',
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = ShoppingCartListSerializer
     
     def get_total_price(self, obj):
         return str(obj.calculate_total_price())
@@ -99,41 +153,43 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         return str(obj.calculate_total_weight())
     
     def get_item_count(self, obj):
-        return obj.items.count()
+        return obj.calculate_item_count()
 
 
-class AddProductSerializer(serializers.Serializer):
-    """Serializer for adding a product to the cart."""
+def _product_queryset(product_type):
+    """Return the queryset to load products of a type from, with what their display name needs."""
+    queryset = PRODUCT_MODELS[product_type].objects.all()
+    if product_type == 'musicalbum':
+        # The stored display name includes the artist
+        queryset = queryset.select_related('artist')
+    return queryset
+
+
+class CartProductSerializer(serializers.Serializer):
+    """Fields identifying a product and a quantity of it, shared by the add and remove serializers."""
     product_type = serializers.ChoiceField(
-        choices=['book', 'musicalbum', 'softwarelicense'],
+        choices=list(PRODUCT_MODELS),
         required=True,
         help_text="Type of product: 'book', 'musicalbum', or 'softwarelicense'"
     )
     product_id = serializers.UUIDField(required=True)
     quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class AddProductSerializer(CartProductSerializer):
+    """Serializer for adding a product to the cart."""
     
     def validate(self, attrs):
-        product_type = attrs['product_type'].lower()
+        # The ChoiceField has already checked product_type against PRODUCT_MODELS
+        product_type = attrs['product_type']
         product_id = attrs['product_id']
         
-        # Map product type to model
-        model_map = {
-            'book': Book,
-            'musicalbum': MusicAlbum,
-            'softwarelicense': SoftwareLicense,
-        }
-        
-        if product_type not in model_map:
-            raise serializers.ValidationError(
-                f"Invalid product_type. Must be one of: {', '.join(model_map.keys())}"
-            )
-        
         # Get the model class
-        model_class = model_map[product_type]
+        model_class = PRODUCT_MODELS[product_type]
         
         # Check if product exists
         try:
-            product = model_class.objects.get(id=product_id)
+            product = _product_queryset(product_type).get(id=product_id)
             attrs['product'] = product
         except model_class.DoesNotExist:
             raise serializers.ValidationError(
@@ -143,33 +199,58 @@ class AddProductSerializer(serializers.Serializer):
         return attrs
 
 
-class RemoveProductSerializer(serializers.Serializer):
-    """Serializer for removing a product from the cart."""
-    product_type = serializers.ChoiceField(
-        choices=['book', 'musicalbum', 'softwarelicense'],
-        required=True
-    )
-    product_id = serializers.UUIDField(required=True)
-    quantity = serializers.IntegerField(min_value=1, default=1)
+# Most entries accepted by one add-products request
+ADD_PRODUCTS_MAX_ITEMS = 100
+
+
+class AddProductsSerializer(serializers.ListSerializer):
+    """
+    Serializer for adding several products to the cart at once.
+    
+    Loads the products with one in_bulk() query per product type instead of
+    one query per entry.
+    """
     
     def validate(self, attrs):
-        product_type = attrs['product_type'].lower()
-        product_id = attrs['product_id']
+        product_ids = defaultdict(set)
+        for entry in attrs:
+            product_ids[entry['product_type']].add(entry['product_id'])
         
-        # Map product type to model
-        model_map = {
-            'book': Book,
-            'musicalbum': MusicAlbum,
-            'softwarelicense': SoftwareLicense,
+        products = {
+            product_type: _product_queryset(product_type).in_bulk(list(ids))
+            for product_type, ids in product_ids.items()
         }
         
-        if product_type not in model_map:
-            raise serializers.ValidationError(
-                f"Invalid product_type. Must be one of: {', '.join(model_map.keys())}"
-            )
+        errors = []
+        for entry in attrs:
+            product = products[entry['product_type']].get(entry['product_id'])
+            if product is None:
+                errors.append(f"{entry['product_type']} with id {entry['product_id']} does not exist.")
+            entry['product'] = product
+        
+        if errors:
+            raise serializers.ValidationError(errors)
+        
+        return attrs
+
+
+class AddProductsItemSerializer(CartProductSerializer):
+    """Serializer for a single entry of a bulk add to the cart."""
+    
+    class Meta:
+        list_serializer_class = AddProductsSerializer
+
+
+class RemoveProductSerializer(CartProductSerializer):
+    """Serializer for removing a product from the cart."""
+    
+    def validate(self, attrs):
+        # The ChoiceField has already checked product_type against PRODUCT_MODELS
+        product_type = attrs['product_type']
+        product_id = attrs['product_id']
         
         # Get the model class
-        model_class = model_map[product_type]
+        model_class = PRODUCT_MODELS[product_type]
         
         # Check if product exists
         try:
@@ -2,7 +2,7 @@
 Service layer for store app business logic.
 """
 from collections import defaultdict, Counter
-from .models import Book, MusicAlbum, SoftwareLicense
+from .models import PRODUCT_MODELS, get_product_display_name
 
 
 def calculate_product_recommendations(carts):
@@ -107,16 +107,14 @@ def _get_product_by_type_and_id(product_type, product_id):
     Returns:
         Product instance (Book, MusicAlbum, or SoftwareLicense) or None
     """
-    from django.contrib.contenttypes.models import ContentType
+    model_class = PRODUCT_MODELS.get(product_type.lower())
+    if model_class is None:
+        return None
     
     try:
-        content_type = ContentType.objects.get(model=product_type.lower())
-        model_class = content_type.model_class()
-        if model_class:
-            return model_class.objects.get(id=product_id)
+        return model_class.objects.get(id=product_id)
     except Exception:
         return None
-    return None
 
 
 def _get_product_name(product):
@@ -132,11 +130,5 @@ def _get_product_name(product):
     if not product:
         return None
     
-    if isinstance(product, Book):
-        return product.title
-    elif isinstance(product, MusicAlbum):
-        return f"Album by {product.artist}"
-    elif isinstance(product, SoftwareLicense):
-        return f"License {product.id}"
-    return str(product)
+    return get_product_display_name(product)
 
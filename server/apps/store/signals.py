@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import ShoppingCart, ShoppingCartItem
+
+
+# Saves only: any post_delete receiver on ShoppingCartItem would stop Django
+# from fast-deleting items (clearing or deleting a cart would load every item
+# and touch the cart once per row), so code that deletes items touches the
+# cart itself.
+@receiver(post_save, sender=ShoppingCartItem)
+def touch_cart(sender, instance, **kwargs):
+    """Bump the cart's updated_at when one of its items is saved, invalidating its cached totals."""
+    if ShoppingCartItem.cart.is_cached(instance):
+        # Keep an in-memory cart (e.g. the one add_product was called on) in sync
+        instance.cart.touch()
+    else:
+        ShoppingCart(pk=instance.cart_id).touch()
@@ -1,3 +1,769 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models.query import QuerySet
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.users.models import User
+from .models import (
+    Book,
+    MusicAlbum,
+    ShoppingCart,
+    ShoppingCartItem,
+    SoftwareLicense,
+    cents_to_euros,
+    euros_to_cents,
+    get_product_display_name,
+    grams_to_kilograms,
+    kilograms_to_grams,
+)
+from .serializers import ADD_PRODUCTS_MAX_ITEMS, AddProductSerializer
+from .services import _get_product_name
+
+
+class StoreTestMixin:
+    """Creates a user with a cart and one product of each type."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='customer', password='password')
+        self.artist = User.objects.create_user(username='artist', password='password')
+        self.cart = ShoppingCart.objects.create(user=self.user)
+        self.book = Book.objects.create(
+            title='Django Basics',
+            author=self.artist,
+            number_of_pages=200,
+            price_in_euros=Decimal('19.99'),
+            weight_in_kilograms=Decimal('0.35'),
+        )
+        self.album = MusicAlbum.objects.create(
+            artist=self.artist,
+            number_of_tracks=12,
+            price_in_euros=Decimal('9.99'),
+            weight_in_kilograms=Decimal('0.10'),
+        )
+        self.license = SoftwareLicense.objects.create(
+            price_in_euros=Decimal('49.00'),
+            weight_in_kilograms=Decimal('0.00'),
+        )
+
+
+class StoreAPITestCase(StoreTestMixin, APITestCase):
+    """Store test case with the cart's owner logged in."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def cart_url(self, name):
+        return reverse(f'cart-{name}', kwargs={'pk': self.cart.pk})
+
+
+# The project's manifest storage needs collectstatic, which tests don't run
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StoreAdminTestCase(StoreTestMixin, TestCase):
+    """Store test case with a superuser logged in to the admin."""
+
+    def setUp(self):
+        super().setUp()
+        self.admin_user = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(self.admin_user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+class CartTotalsAnnotationTests(StoreTestMixin, TestCase):
+    def test_annotated_totals_need_no_further_queries(self):
+        self.cart.add_products([(self.book, 2), (self.album, 3), (self.license, 1)])
+
+        annotated = ShoppingCart.objects.with_totals().get(pk=self.cart.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(annotated.calculate_total_price(), Decimal('118.95'))
+            self.assertEqual(annotated.calculate_total_weight(), Decimal('1.00'))
+            self.assertEqual(annotated.calculate_item_count(), 3)
+
+    def test_annotated_totals_of_empty_cart_are_zero(self):
+        annotated = ShoppingCart.objects.with_totals().get(pk=self.cart.pk)
+
+        self.assertEqual(annotated.calculate_total_price(), Decimal('0'))
+        self.assertEqual(annotated.calculate_item_count(), 0)
+
+    def test_with_totals_orders_newest_first(self):
+        older = ShoppingCart.objects.create(user=self.user)
+        ShoppingCart.objects.filter(pk=older.pk).update(created_at=timezone.now() - timedelta(days=1))
+
+        carts = list(ShoppingCart.objects.filter(user=self.user).with_totals())
+
+        self.assertEqual([cart.pk for cart in carts], [self.cart.pk, older.pk])
+
+
+class CartListAPITests(StoreAPITestCase):
+    def test_list_orders_carts_newest_first(self):
+        older = ShoppingCart.objects.create(user=self.user)
+        ShoppingCart.objects.filter(pk=older.pk).update(created_at=timezone.now() - timedelta(days=1))
+
+        response = self.client.get(reverse('cart-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [cart['id'] for cart in response.data['results']],
+            [str(self.cart.pk), str(older.pk)],
+        )
+
+    def test_list_returns_annotated_totals(self):
+        self.cart.add_product(self.book, 2)
+
+        response = self.client.get(reverse('cart-list'))
+
+        cart = response.data['results'][0]
+        self.assertEqual(cart['total_price'], '39.98')
+        self.assertEqual(cart['total_weight'], '0.70')
+        self.assertEqual(cart['item_count'], 1)
+
+
+class AddProductsTests(StoreTestMixin, TestCase):
+    def test_add_products_merges_and_increments(self):
+        self.cart.add_product(self.book, 1)
+
+        count = self.cart.add_products([(self.book, 2), (self.album, 1), (self.album, 4)])
+
+        self.assertEqual(count, 2)
+        quantities = {item.object_id: item.quantity for item in self.cart.items.all()}
+        self.assertEqual(quantities, {self.book.id: 3, self.album.id: 5})
+
+    def test_add_products_query_count_does_not_grow_with_products(self):
+        products = [(self.book, 1), (self.album, 1), (self.license, 1)]
+        ContentType.objects.get_for_models(Book, MusicAlbum, SoftwareLicense)
+
+        # Savepoint, cart lock, existing quantities, upsert, touch, release
+        with self.assertNumQueries(6):
+            self.cart.add_products(products)
+
+
+class AddProductsAPITests(StoreAPITestCase):
+    def post_products(self, payload):
+        return self.client.post(self.cart_url('add-products'), payload, format='json')
+
+    def test_add_products_merges_repeated_entries(self):
+        self.cart.add_product(self.book, 1)
+
+        response = self.post_products([
+            {'product_type': 'book', 'product_id': str(self.book.id), 'quantity': 2},
+            {'product_type': 'musicalbum', 'product_id': str(self.album.id)},
+            {'product_type': 'musicalbum', 'product_id': str(self.album.id), 'quantity': 2},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cart = response.data['cart']
+        quantities = {item['product_id']: item['quantity'] for item in cart['items']}
+        self.assertEqual(quantities, {str(self.book.id): 3, str(self.album.id): 3})
+        self.assertEqual(cart['total_price'], '89.94')
+        self.assertEqual(cart['item_count'], 2)
+
+    def test_add_products_rejects_unknown_product(self):
+        response = self.post_products([
+            {'product_type': 'book', 'product_id': str(self.book.id)},
+            {'product_type': 'book', 'product_id': str(self.album.id)},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_add_products_rejects_empty_list(self):
+        response = self.post_products([])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_add_products_rejects_too_many_entries(self):
+        entry = {'product_type': 'book', 'product_id': str(self.book.id)}
+
+        response = self.post_products([entry] * (ADD_PRODUCTS_MAX_ITEMS + 1))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_add_products_rejects_invalid_entries(self):
+        response = self.post_products([
+            {'product_type': 'vinyl', 'product_id': str(self.book.id)},
+            {'product_type': 'book', 'product_id': str(self.book.id), 'quantity': 0},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.cart.items.exists())
+
+
+class AddProductTests(StoreTestMixin, TestCase):
+    def test_add_product_increments_existing_item(self):
+        self.cart.add_product(self.book, 2)
+        self.cart.add_product(self.book, 3)
+
+        self.assertEqual(self.cart.items.get().quantity, 5)
+
+    def test_add_product_increment_skips_reading_the_item_back(self):
+        self.cart.add_product(self.book, 2)
+
+        # Savepoint, cart lock, increment, touch, release
+        with self.assertNumQueries(5):
+            self.assertIsNone(self.cart.add_product(self.book, 1))
+
+    def test_add_product_adds_to_item_inserted_concurrently(self):
+        self.cart.add_product(self.book, 1)
+        real_update = QuerySet.update
+        calls = []
+
+        def update_missing_first_time(queryset, **kwargs):
+            # The first increment misses, as if another writer inserted the
+            # item between it and the insert
+            calls.append(kwargs)
+            if len(calls) == 1:
+                return 0
+            return real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update_missing_first_time):
+            self.cart.add_product(self.book, 2)
+
+        self.assertEqual(self.cart.items.get().quantity, 3)
+
+
+class ShoppingCartAdminTests(StoreAdminTestCase):
+    def test_changelist_shows_annotated_totals(self):
+        self.cart.add_products([(self.book, 2), (self.album, 1)])
+
+        response = self.client.get(reverse('admin:store_shoppingcart_changelist'))
+
+        self.assertContains(response, '€49.97')
+        self.assertContains(response, '0.80 kg')
+
+    def test_changelist_query_count_does_not_grow_with_carts(self):
+        url = reverse('admin:store_shoppingcart_changelist')
+        self.cart.add_product(self.book)
+        queries_for_one_cart = self.count_queries(url)
+
+        for _ in range(3):
+            ShoppingCart.objects.create(user=self.user).add_products([(self.book, 1), (self.album, 2)])
+
+        self.assertEqual(self.count_queries(url), queries_for_one_cart)
+
+    def test_changelist_sorts_by_annotated_total(self):
+        cheaper = ShoppingCart.objects.create(user=self.user)
+        cheaper.add_product(self.album)
+        self.cart.add_product(self.book)
+        url = reverse('admin:store_shoppingcart_changelist')
+        column = self.client.get(url).context['cl'].list_display.index('get_total_price')
+
+        # Descending, the opposite of the default newest-first order here
+        response = self.client.get(url, {'o': f'-{column}'})
+
+        carts = list(response.context['cl'].result_list)
+        self.assertEqual([cart.pk for cart in carts], [self.cart.pk, cheaper.pk])
+
+
+class ShoppingCartItemAdminTests(StoreAdminTestCase):
+    def test_changelist_loads_only_rendered_columns(self):
+        self.cart.add_product(self.book)
+
+        response = self.client.get(reverse('admin:store_shoppingcartitem_changelist'))
+
+        item = response.context['cl'].result_list[0]
+        self.assertEqual(item.get_deferred_fields(), {'created_at', 'updated_at'})
+        self.assertContains(response, 'Django Basics')
+
+    def test_changelist_query_count_does_not_grow_with_items(self):
+        url = reverse('admin:store_shoppingcartitem_changelist')
+        self.cart.add_product(self.book)
+        queries_for_one_item = self.count_queries(url)
+
+        self.cart.add_products([(self.album, 2), (self.license, 1)])
+        ShoppingCart.objects.create(user=self.user).add_product(self.book)
+
+        self.assertEqual(self.count_queries(url), queries_for_one_item)
+
+
+class StoreConfigTests(TestCase):
+    def test_ready_does_not_touch_the_database(self):
+        with self.assertNumQueries(0):
+            apps.get_app_config('store').ready()
+
+
+class CartTotalsAPITests(StoreAPITestCase):
+    def test_totals_are_one_query(self):
+        self.cart.add_products([(self.book, 2), (self.album, 1)])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.cart_url('get-totals'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'cart_id': str(self.cart.pk),
+            'total_price': '49.97',
+            'total_weight': '0.80',
+            'item_count': 2,
+        })
+
+    def test_totals_of_another_users_cart_are_not_found(self):
+        other_cart = ShoppingCart.objects.create(user=self.artist)
+
+        response = self.client.get(reverse('cart-get-totals', kwargs={'pk': other_cart.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_totals_of_malformed_id_are_not_found(self):
+        response = self.client.get(reverse('cart-get-totals', kwargs={'pk': 'not-a-uuid'}))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MyCartAPITests(StoreAPITestCase):
+    def test_slim_cart_has_totals_without_items(self):
+        self.cart.add_products([(self.book, 1), (self.license, 2)])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('cart-get-my-cart'), {'slim': '1'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'id': str(self.cart.pk),
+            'total_price': '117.99',
+            'total_weight': '0.35',
+            'item_count': 2,
+        })
+
+    def test_full_cart_includes_items(self):
+        self.cart.add_product(self.book)
+
+        response = self.client.get(reverse('cart-get-my-cart'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['product_id'] for item in response.data['items']], [str(self.book.pk)])
+
+    def test_slim_cart_is_created_when_missing(self):
+        self.cart.delete()
+
+        response = self.client.get(reverse('cart-get-my-cart'), {'slim': 'true'})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_price'], '0.00')
+        self.assertEqual(response.data['item_count'], 0)
+        self.assertTrue(ShoppingCart.objects.filter(user=self.user).exists())
+
+
+class ShoppingCartItemsTableTests(StoreAdminTestCase):
+    def test_change_page_lists_items_with_add_link(self):
+        self.cart.add_products([(self.book, 2), (self.album, 1)])
+
+        response = self.client.get(reverse('admin:store_shoppingcart_change', args=[self.cart.pk]))
+
+        self.assertContains(response, 'Django Basics')
+        self.assertContains(response, 'Album by artist')
+        self.assertContains(response, '€39.98')
+        self.assertContains(response, f"{reverse('admin:store_shoppingcartitem_add')}?cart={self.cart.pk}")
+
+    def test_add_page_has_no_items_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:store_shoppingcart_add'))
+
+        self.assertFalse([query for query in queries if 'store_shoppingcartitem' in query['sql']])
+        self.assertContains(response, 'Save the cart before adding items.')
+        self.assertNotContains(response, 'Add cart item')
+
+
+class ShoppingCartItemAdminFormTests(StoreAdminTestCase):
+    def item_data(self, product, **overrides):
+        data = {
+            'cart': self.cart.pk,
+            'content_type': ContentType.objects.get_for_model(product).pk,
+            'object_id': product.pk,
+            'quantity': 2,
+        }
+        data.update(overrides)
+        return data
+
+    def test_add_form_picks_the_cart_by_id(self):
+        response = self.client.get(reverse('admin:store_shoppingcartitem_add'), {'cart': self.cart.pk})
+
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+        self.assertContains(response, f'value="{self.cart.pk}"')
+
+    def test_add_fills_price_weight_and_name_from_product(self):
+        response = self.client.post(reverse('admin:store_shoppingcartitem_add'), self.item_data(self.album))
+
+        self.assertEqual(response.status_code, 302)
+        item = self.cart.items.get()
+        self.assertEqual(item.quantity, 2)
+        self.assertEqual(item.price_in_cents, 999)
+        self.assertEqual(item.weight_in_grams, 100)
+        self.assertEqual(item.product_display_name, 'Album by artist')
+
+    def test_add_rejects_unknown_product(self):
+        response = self.client.post(
+            reverse('admin:store_shoppingcartitem_add'),
+            self.item_data(self.book, object_id=self.album.pk),
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response.context['adminform'].form, 'object_id', f'book with id {self.album.pk} does not exist.'
+        )
+        self.assertFalse(self.cart.items.exists())
+
+    def test_add_rejects_non_product_content_type(self):
+        data = self.item_data(self.book, content_type=ContentType.objects.get_for_model(ShoppingCart).pk)
+
+        response = self.client.post(reverse('admin:store_shoppingcartitem_add'), data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('content_type', response.context['adminform'].form.errors)
+        self.assertFalse(self.cart.items.exists())
+
+
+class CartTotalsCacheTests(StoreTestMixin, TestCase):
+    def test_totals_stay_fresh_through_cache(self):
+        self.cart.add_product(self.book, 2)
+        self.assertEqual(self.cart.calculate_total_price(), Decimal('39.98'))
+        self.assertEqual(self.cart.calculate_total_weight(), Decimal('0.70'))
+        self.assertEqual(self.cart.calculate_item_count(), 1)
+
+        self.cart.add_product(self.album, 1)
+        self.assertEqual(self.cart.calculate_total_price(), Decimal('49.97'))
+        self.assertEqual(self.cart.calculate_item_count(), 2)
+
+        self.cart.remove_product(self.book, 1)
+        self.assertEqual(self.cart.calculate_total_price(), Decimal('29.98'))
+        self.assertEqual(self.cart.calculate_total_weight(), Decimal('0.45'))
+
+        self.cart.remove_product(self.book, 1)
+        self.assertEqual(self.cart.calculate_total_price(), Decimal('9.99'))
+        self.assertEqual(self.cart.calculate_item_count(), 1)
+
+    def test_cached_totals_need_no_queries(self):
+        self.cart.add_product(self.book, 2)
+        self.cart.calculate_total_price()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cart.calculate_total_price(), Decimal('39.98'))
+            self.assertEqual(self.cart.calculate_item_count(), 1)
+
+    def test_unsaved_cart_totals_are_zero(self):
+        cart = ShoppingCart(user=self.user)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.calculate_total_price(), Decimal('0'))
+            self.assertEqual(cart.calculate_total_weight(), Decimal('0'))
+            self.assertEqual(cart.calculate_item_count(), 0)
+
+
+class CartDeleteAPITests(StoreAPITestCase):
+    def fill_cart(self, cart, count):
+        products = [
+            SoftwareLicense.objects.create(price_in_euros=Decimal('1.00'), weight_in_kilograms=Decimal('0.00'))
+            for _ in range(count)
+        ]
+        cart.add_products((product, 1) for product in products)
+
+    def count_queries(self, method, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = method(url)
+        self.assertEqual(response.status_code // 100, 2)
+        return len(queries)
+
+    def test_clear_updates_totals(self):
+        totals_url = self.cart_url('get-totals')
+        self.cart.add_products([(self.book, 2), (self.album, 1)])
+        self.assertEqual(self.client.get(totals_url).data['total_price'], '49.97')
+
+        response = self.client.delete(self.cart_url('clear-cart'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cart']['item_count'], 0)
+        self.assertEqual(response.data['cart']['total_price'], '0.00')
+        self.assertEqual(self.client.get(totals_url).data['item_count'], 0)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.calculate_total_price(), Decimal('0'))
+
+    def test_remove_updates_totals(self):
+        self.cart.add_products([(self.book, 2), (self.album, 1)])
+        url = self.cart_url('remove-product')
+
+        self.client.post(url, {'product_type': 'book', 'product_id': str(self.book.id)}, format='json')
+        response = self.client.post(url, {'product_type': 'book', 'product_id': str(self.book.id)}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['cart']['total_price'], '9.99')
+        self.assertEqual(self.client.get(self.cart_url('get-totals')).data['total_price'], '9.99')
+
+    def test_clear_query_count_does_not_grow_with_items(self):
+        small_cart = ShoppingCart.objects.create(user=self.user)
+        self.fill_cart(small_cart, 1)
+        self.fill_cart(self.cart, 20)
+
+        self.assertEqual(
+            self.count_queries(self.client.delete, self.cart_url('clear-cart')),
+            self.count_queries(self.client.delete, reverse('cart-clear-cart', kwargs={'pk': small_cart.pk})),
+        )
+        self.assertFalse(self.cart.items.exists())
+
+    def test_destroy_query_count_does_not_grow_with_items(self):
+        small_cart = ShoppingCart.objects.create(user=self.user)
+        self.fill_cart(small_cart, 1)
+        self.fill_cart(self.cart, 20)
+
+        self.assertEqual(
+            self.count_queries(self.client.delete, reverse('cart-detail', kwargs={'pk': self.cart.pk})),
+            self.count_queries(self.client.delete, reverse('cart-detail', kwargs={'pk': small_cart.pk})),
+        )
+        self.assertFalse(ShoppingCart.objects.filter(pk=self.cart.pk).exists())
+
+
+class CartTotalsAdminTests(StoreAdminTestCase):
+    def test_add_cart_page_shows_zero_totals(self):
+        response = self.client.get(reverse('admin:store_shoppingcart_add'))
+
+        self.assertContains(response, '€0.00')
+        self.assertContains(response, '0.00 kg')
+
+    def test_deleting_an_item_updates_cart_totals(self):
+        self.cart.add_products([(self.book, 1), (self.album, 1)])
+        self.assertEqual(self.cart.calculate_total_price(), Decimal('29.98'))
+        item = self.cart.items.get(object_id=self.book.pk)
+
+        self.client.post(reverse('admin:store_shoppingcartitem_delete', args=[item.pk]), {'post': 'yes'})
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.calculate_total_price(), Decimal('9.99'))
+
+    def test_bulk_deleting_items_updates_cart_totals(self):
+        self.cart.add_products([(self.book, 1), (self.album, 1)])
+        self.assertEqual(self.cart.calculate_item_count(), 2)
+
+        self.client.post(reverse('admin:store_shoppingcartitem_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': [str(item.pk) for item in self.cart.items.all()],
+            'post': 'yes',
+        })
+
+        self.cart.refresh_from_db()
+        self.assertFalse(self.cart.items.exists())
+        self.assertEqual(self.cart.calculate_item_count(), 0)
+
+
+class MinorUnitTests(StoreTestMixin, TestCase):
+    def test_euros_round_trip_through_cents(self):
+        for amount in ['0.00', '0.01', '0.29', '19.99', '1234.56']:
+            cents = euros_to_cents(Decimal(amount))
+            self.assertIsInstance(cents, int)
+            self.assertEqual(cents_to_euros(cents), Decimal(amount))
+        self.assertEqual(euros_to_cents(Decimal('19.99')), 1999)
+
+    def test_kilograms_round_trip_through_grams(self):
+        for weight in ['0.00', '0.01', '0.35', '2.50']:
+            grams = kilograms_to_grams(Decimal(weight))
+            self.assertIsInstance(grams, int)
+            self.assertEqual(grams_to_kilograms(grams), Decimal(weight))
+        self.assertEqual(kilograms_to_grams(Decimal('0.35')), 350)
+
+    def test_item_stores_cents_and_grams(self):
+        self.cart.add_product(self.book, 3)
+
+        item = self.cart.items.get()
+        self.assertEqual((item.price_in_cents, item.weight_in_grams), (1999, 350))
+        self.assertEqual(item.product_price, Decimal('19.99'))
+        self.assertEqual(item.product_weight, Decimal('0.35'))
+        self.assertEqual(item.get_subtotal_price(), Decimal('59.97'))
+        self.assertEqual(item.get_subtotal_weight(), Decimal('1.05'))
+
+    def test_price_and_weight_setters_store_minor_units(self):
+        item = ShoppingCartItem(product_price=Decimal('12.34'), product_weight=Decimal('1.50'))
+
+        self.assertEqual((item.price_in_cents, item.weight_in_grams), (1234, 1500))
+
+    def test_sql_subtotals_handle_large_lines(self):
+        self.cart.add_product(self.book, 1)
+        # 2**31 cents at quantity 2 overflows a 32-bit product
+        self.cart.items.update(price_in_cents=2 ** 31, quantity=2)
+
+        item = ShoppingCartItem.objects.with_subtotals().get()
+        cart = ShoppingCart.objects.with_totals().get(pk=self.cart.pk)
+
+        self.assertEqual(item.subtotal_price_cents, 2 ** 32)
+        self.assertEqual(cart.total_price_cents_ann, 2 ** 32)
+
+
+class CartItemAPITests(StoreAPITestCase):
+    def test_item_exposes_euros_and_kilograms(self):
+        self.cart.add_product(self.book, 3)
+
+        response = self.client.get(reverse('cart-detail', kwargs={'pk': self.cart.pk}))
+
+        item = response.data['items'][0]
+        self.assertEqual(item['product_price'], '19.99')
+        self.assertEqual(item['product_weight'], '0.35')
+        self.assertEqual(item['subtotal_price'], '59.97')
+        self.assertEqual(item['subtotal_weight'], '1.05')
+
+
+class ProductDisplayNameTests(StoreTestMixin, TestCase):
+    def test_add_product_stores_readable_names(self):
+        self.cart.add_products([(self.book, 1), (self.album, 1), (self.license, 1)])
+
+        names = {item.object_id: item.product_display_name for item in self.cart.items.all()}
+        self.assertEqual(names, {
+            self.book.pk: 'Django Basics',
+            self.album.pk: 'Album by artist',
+            self.license.pk: f'License {self.license.pk}',
+        })
+
+    def test_names_match_recommendations(self):
+        for product in [self.book, self.album, self.license]:
+            self.assertEqual(get_product_display_name(product), _get_product_name(product))
+
+    def test_save_does_not_resolve_product_for_existing_blank_name(self):
+        self.cart.add_product(self.book)
+        self.cart.items.update(product_display_name='')
+        item = ShoppingCartItem.objects.get()
+        item.quantity = 4
+
+        # The item update and the cart touch; no product lookup
+        with self.assertNumQueries(2):
+            item.save()
+
+        item.refresh_from_db()
+        self.assertEqual(item.product_display_name, '')
+
+    def test_single_add_loads_album_artist_with_the_album(self):
+        serializer = AddProductSerializer(data={'product_type': 'musicalbum', 'product_id': str(self.album.pk)})
+        self.assertTrue(serializer.is_valid())
+
+        with self.assertNumQueries(0):
+            name = get_product_display_name(serializer.validated_data['product'])
+
+        self.assertEqual(name, 'Album by artist')
+
+
+class ProductDisplayNameAPITests(StoreAPITestCase):
+    def test_item_exposes_stored_product_name(self):
+        self.cart.add_product(self.album)
+
+        response = self.client.get(reverse('cart-detail', kwargs={'pk': self.cart.pk}))
+
+        self.assertEqual(response.data['items'][0]['product_name'], 'Album by artist')
+
+
+class ShoppingCartItemChangeFormTests(StoreAdminTestCase):
+    def test_product_is_read_only_on_change(self):
+        self.cart.add_product(self.book)
+        item = self.cart.items.get()
+
+        response = self.client.post(reverse('admin:store_shoppingcartitem_change', args=[item.pk]), {
+            'cart': self.cart.pk,
+            'content_type': ContentType.objects.get_for_model(MusicAlbum).pk,
+            'object_id': self.album.pk,
+            'quantity': 5,
+        })
+
+        self.assertEqual(response.status_code, 302)
+        item.refresh_from_db()
+        self.assertEqual((item.object_id, item.quantity), (self.book.pk, 5))
+        self.assertEqual(item.product_display_name, 'Django Basics')
+        self.assertEqual(item.price_in_cents, 1999)
+
+
+class CartPrefetchAPITests(StoreAPITestCase):
+    def add_albums(self, cart, count):
+        albums = [
+            MusicAlbum.objects.create(
+                artist=User.objects.create_user(username=f'artist-{cart.pk}-{index}'),
+                number_of_tracks=10,
+                price_in_euros=Decimal('5.00'),
+                weight_in_kilograms=Decimal('0.10'),
+            )
+            for index in range(count)
+        ]
+        cart.add_products((album, 1) for album in albums)
+
+    def count_queries(self, method, url, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = method(url, *args, **kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return queries
+
+    def test_retrieve_query_count_does_not_grow_with_items(self):
+        url = reverse('cart-detail', kwargs={'pk': self.cart.pk})
+        self.cart.add_products([(self.book, 1), (self.album, 1)])
+        queries_for_few_items = len(self.count_queries(self.client.get, url))
+
+        self.add_albums(self.cart, 5)
+
+        self.assertEqual(len(self.count_queries(self.client.get, url)), queries_for_few_items)
+
+    def test_list_query_count_does_not_grow_with_carts(self):
+        url = reverse('cart-list')
+        self.cart.add_products([(self.book, 1), (self.album, 1)])
+        queries_for_one_cart = len(self.count_queries(self.client.get, url))
+
+        for _ in range(3):
+            cart = ShoppingCart.objects.create(user=self.user)
+            cart.add_product(self.book)
+            self.add_albums(cart, 2)
+
+        self.assertEqual(len(self.count_queries(self.client.get, url)), queries_for_one_cart)
+
+    def test_mutations_aggregate_totals_only_for_the_response(self):
+        self.cart.add_products([(self.book, 1), (self.album, 1)])
+
+        queries = self.count_queries(
+            self.client.post,
+            self.cart_url('add-product'),
+            {'product_type': 'book', 'product_id': str(self.book.id)},
+            format='json',
+        )
+
+        # The lookup of the cart being changed isn't annotated; only the reload is
+        self.assertEqual(len([query for query in queries if 'SUM(' in query['sql']]), 1)
+
+
+class ProductTypeAPITests(StoreAPITestCase):
+    def test_each_product_type_can_be_added(self):
+        for product_type, product in [('book', self.book), ('musicalbum', self.album), ('softwarelicense', self.license)]:
+            response = self.client.post(
+                self.cart_url('add-product'),
+                {'product_type': product_type, 'product_id': str(product.pk)},
+                format='json',
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.cart.items.count(), 3)
+
+    def test_unknown_product_type_is_rejected(self):
+        for action in ['add-product', 'remove-product']:
+            response = self.client.post(
+                self.cart_url(action),
+                {'product_type': 'vinyl', 'product_id': str(self.book.pk)},
+                format='json',
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('product_type', response.data)
+
+    def test_product_of_another_type_is_not_found(self):
+        response = self.client.post(
+            self.cart_url('add-product'),
+            {'product_type': 'book', 'product_id': str(self.album.pk)},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.cart.items.exists())
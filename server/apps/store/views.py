@@ -1,11 +1,16 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.http import Http404
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from .models import ShoppingCart
+from .models import ShoppingCart, ShoppingCartItem, cents_to_euros, grams_to_kilograms
 from .serializers import (
     ShoppingCartSerializer,
     AddProductSerializer,
+    AddProductsItemSerializer,
+    ADD_PRODUCTS_MAX_ITEMS,
     RemoveProductSerializer,
     ProductRecommendationSerializer
 )
@@ -27,9 +32,39 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     tags = ['Shopping Cart']
     
+    # Actions that only load the cart to change it; the response reloads it
+    # through reload_cart, so skip annotating totals and prefetching items
+    cart_mutation_actions = ['add_product', 'add_products', 'remove_product', 'clear_cart', 'destroy']
+    
     def get_queryset(self):
-        """Return shopping carts for the authenticated user."""
-        return ShoppingCart.objects.filter(user=self.request.user)
+        """Return shopping carts for the authenticated user, annotated with their totals when they're read."""
+        queryset = ShoppingCart.objects.filter(user=self.request.user)
+        if self.action in self.cart_mutation_actions:
+            return queryset
+        queryset = queryset.with_totals()
+        if self.action == 'get_totals':
+            # Only reads the annotated totals, not the items
+            return queryset
+        return self.prefetch_items(queryset)
+    
+    def reload_cart(self, cart):
+        """Reload a changed cart in one query, with fresh totals annotated and its items prefetched."""
+        return self.prefetch_items(
+            ShoppingCart.objects.filter(user=self.request.user).with_totals()
+        ).get(pk=cart.pk)
+    
+    def prefetch_items(self, queryset):
+        """
+        Prefetch cart items with their content types and products, so the
+        nested item serializer doesn't query per item.
+        """
+        return queryset.prefetch_related(
+            Prefetch(
+                'items',
+                queryset=ShoppingCartItem.objects.select_related('content_type').order_by('created_at')
+            ),
+            'items__product',
+        )
     
     def perform_create(self, serializer):
         """Automatically assign the cart to the authenticated user."""
@@ -54,9 +89,10 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
             product = serializer.validated_data['product']
             quantity = serializer.validated_data.get('quantity', 1)
             
-            cart_item = cart.add_product(product, quantity)
+            cart.add_product(product, quantity)
             
-            # Return updated cart
+            # Return updated cart, reloaded once with fresh totals annotated
+            cart = self.reload_cart(cart)
             cart_serializer = ShoppingCartSerializer(cart)
             return Response(
                 {
@@ -68,6 +104,45 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=True, methods=['post'], url_path='add-products')
+    def add_products(self, request, pk=None):
+        """
+        Add several products to the shopping cart in one request.
+        
+        Expected payload:
+        [
+            {
+                "product_type": "book" | "musicalbum" | "softwarelicense",
+                "product_id": "uuid",
+                "quantity": 1 (optional, defaults to 1)
+            },
+            ...
+        ]
+        """
+        cart = self.get_object()
+        serializer = AddProductsItemSerializer(
+            data=request.data, many=True, allow_empty=False, max_length=ADD_PRODUCTS_MAX_ITEMS
+        )
+        
+        if serializer.is_valid():
+            cart.add_products(
+                (entry['product'], entry['quantity'])
+                for entry in serializer.validated_data
+            )
+            
+            # Return updated cart, reloaded once with fresh totals annotated
+            cart = self.reload_cart(cart)
+            cart_serializer = ShoppingCartSerializer(cart)
+            return Response(
+                {
+                    'message': 'Products added to cart successfully',
+                    'cart': cart_serializer.data
+                },
+                status=status.HTTP_200_OK
+            )
+        
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
     @action(detail=True, methods=['post'], url_path='remove-product')
     def remove_product(self, request, pk=None):
         """
@@ -90,7 +165,8 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
             removed = cart.remove_product(product, quantity)
             
             if removed:
-                # Return updated cart
+                # Return updated cart, reloaded once with fresh totals annotated
+                cart = self.reload_cart(cart)
                 cart_serializer = ShoppingCartSerializer(cart)
                 return Response(
                     {
@@ -111,30 +187,55 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
     def get_totals(self, request, pk=None):
         """
         Get the total price and weight of all items in the cart.
+        
+        Served from a single annotated values() query, without loading the
+        cart instance.
         """
-        cart = self.get_object()
+        try:
+            totals = self.get_queryset().filter(pk=pk).values(
+                'id', 'total_price_cents_ann', 'total_weight_grams_ann', 'item_count_ann'
+            ).first()
+        except (TypeError, ValueError, ValidationError):
+            totals = None
+        
+        if totals is None:
+            raise Http404
         
         return Response({
-            'cart_id': str(cart.id),
-            'total_price': str(cart.calculate_total_price()),
-            'total_weight': str(cart.calculate_total_weight()),
-            'item_count': cart.items.count(),
+            'cart_id': str(totals['id']),
+            'total_price': str(cents_to_euros(totals['total_price_cents_ann'])),
+            'total_weight': str(grams_to_kilograms(totals['total_weight_grams_ann'])),
+            'item_count': totals['item_count_ann'],
         }, status=status.HTTP_200_OK)
     
     @action(detail=False, methods=['get'], url_path='my-cart')
     def get_my_cart(self, request):
         """
         Get or create the current user's active shopping cart.
+        
+        Query Parameters:
+        - slim (optional): If true, return only the cart id and totals, without the items
         """
-        cart, created = ShoppingCart.objects.get_or_create(
+        slim = request.query_params.get('slim', 'false').lower() in ('1', 'true')
+        
+        queryset = ShoppingCart.objects.with_totals()
+        if not slim:
+            queryset = self.prefetch_items(queryset)
+        cart, created = queryset.get_or_create(
             user=request.user
         )
+        response_status = status.HTTP_200_OK if not created else status.HTTP_201_CREATED
+        
+        if slim:
+            return Response({
+                'id': str(cart.id),
+                'total_price': str(cart.calculate_total_price()),
+                'total_weight': str(cart.calculate_total_weight()),
+                'item_count': cart.calculate_item_count(),
+            }, status=response_status)
         
         serializer = self.get_serializer(cart)
-        return Response(
-            serializer.data,
-            status=status.HTTP_200_OK if not created else status.HTTP_201_CREATED
-        )
+        return Response(serializer.data, status=response_status)
     
     @action(detail=True, methods=['delete'], url_path='clear')
     def clear_cart(self, request, pk=None):
@@ -143,7 +244,10 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
         """
         cart = self.get_object()
         cart.items.all().delete()
+        # A bulk delete sends no signal that touches the cart (see signals.py)
+        cart.touch()
         
+        cart = self.reload_cart(cart)
         serializer = self.get_serializer(cart)
         return Response(
             {